@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+卸载策略微基准：测量并发大图片处理时的事件循环延迟
+
+模拟 /process-image 中的 CPU 密集步骤（base64 编码、JSON 解析、data URL 拆分、base64 解码），
+分别在事件循环内直接执行和按阈值卸载到线程池，对比同期事件循环的唤醒延迟
+
+用法:
+    python bench_offload.py [--size-mb 12] [--concurrency 8] [--rounds 3]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import time
+from bg_api.offload import OffloadPolicy, loads, split_data_url
+
+
+def make_payload(size_mb: float) -> bytes:
+    """构造与上游响应结构相同、内含 size_mb 大小图片的 JSON 响应体"""
+    image = os.urandom(int(size_mb * 1024 * 1024))
+    data_url = "data:image/png;base64," + base64.b64encode(image).decode("utf-8")
+    body = {
+        "id": "bench",
+        "choices": [{"message": {"content": "", "images": [{"image_url": {"url": data_url}}]}}],
+    }
+    return json.dumps(body).encode("utf-8")
+
+
+async def pipeline_inline(image: bytes, payload: bytes) -> None:
+    """原实现：所有步骤直接在事件循环中执行"""
+    base64.b64encode(image).decode("utf-8")
+    data = loads(payload)
+    url = data["choices"][0]["message"]["images"][0]["image_url"]["url"]
+    _, data_part = split_data_url(url)
+    base64.b64decode(data_part)
+
+
+async def pipeline_offload(policy: OffloadPolicy, image: bytes, payload: bytes) -> None:
+    """卸载策略：超过阈值的步骤在线程池中执行"""
+    await policy.b64encode(image)
+    data = await policy.json_loads(payload)
+    url = data["choices"][0]["message"]["images"][0]["image_url"]["url"]
+    _, data_part = await policy.run(split_data_url, url, size=len(url))
+    await policy.b64decode(data_part)
+
+
+async def measure(make_job, concurrency: int, interval: float = 0.001) -> dict:
+    """并发执行 make_job，同时以固定间隔采样事件循环唤醒延迟"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    done = asyncio.Event()
+
+    async def monitor():
+        while not done.is_set():
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lags.append((loop.time() - expected) * 1000)
+
+    monitor_task = asyncio.create_task(monitor())
+    await asyncio.sleep(interval * 5)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(make_job() for _ in range(concurrency)))
+    elapsed = (time.perf_counter() - start) * 1000
+
+    done.set()
+    await monitor_task
+
+    lags.sort()
+    return {
+        "elapsed_ms": elapsed,
+        "lag_max_ms": lags[-1],
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1] if len(lags) >= 100 else lags[-1],
+        "lag_median_ms": statistics.median(lags),
+    }
+
+
+def report(name: str, results: list) -> None:
+    def avg(key):
+        return sum(r[key] for r in results) / len(results)
+    print(
+        f"{name:<8} 总耗时 {avg('elapsed_ms'):8.1f}ms | 事件循环延迟 "
+        f"max {avg('lag_max_ms'):7.1f}ms  p99 {avg('lag_p99_ms'):7.1f}ms  "
+        f"median {avg('lag_median_ms'):5.2f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="卸载策略微基准")
+    parser.add_argument("--size-mb", type=float, default=12, help="单张图片大小（MB）")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数")
+    parser.add_argument("--rounds", type=int, default=3, help="重复轮数")
+    parser.add_argument("--threshold", type=int, default=256 * 1024, help="卸载阈值（字节）")
+    parser.add_argument("--workers", type=int, default=1, help="线程池大小")
+    args = parser.parse_args()
+
+    print(f"准备数据: 图片 {args.size_mb}MB, 并发 {args.concurrency}, 轮数 {args.rounds}")
+    image = os.urandom(int(args.size_mb * 1024 * 1024))
+    payload = make_payload(args.size_mb)
+    print(f"响应体大小: {len(payload) / 1024 / 1024:.1f}MB")
+
+    policy = OffloadPolicy(threshold=args.threshold, max_workers=args.workers)
+
+    inline_results, offload_results = [], []
+    for _ in range(args.rounds):
+        inline_results.append(await measure(lambda: pipeline_inline(image, payload), args.concurrency))
+        offload_results.append(await measure(lambda: pipeline_offload(policy, image, payload), args.concurrency))
+
+    report("inline", inline_results)
+    report("offload", offload_results)
+    policy.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -15,11 +15,14 @@ if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
     debug = os.getenv("DEBUG", "True").lower() == "true"
+    # uvicorn 停止监听后等待连接结束的最长秒数（在 SIGTERM 排空之后开始计时）
+    graceful_timeout = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", 10))
     
     uvicorn.run(
         app,
         host=host,
         port=port,
         reload=debug,
-        log_level="info"
+        log_level="info",
+        timeout_graceful_shutdown=graceful_timeout
     )
\ No newline at end of file
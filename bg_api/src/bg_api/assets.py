@@ -0,0 +1,111 @@
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# 配置日志
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=getattr(logging, log_level),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class AssetStore:
+    """
+    短期上传资源存储
+
+    把待发送给上游的图片暂存在内存中，并生成带 HMAC 签名、短时有效的 URL，
+    让上游直接拉取图片，而不是在请求体里内联 base64
+
+    资源只在 discard() 时删除（上游调用期间不会被挤掉），总字节数超过 max_bytes 时
+    put() 拒绝存入，由调用方回退为内联 base64
+
+    资源保存在进程内存中，只有存入资源的进程能提供它：url 模式要求单进程部署
+    （单副本、单 uvicorn worker），或让 PUBLIC_BASE_URL 的 /assets 请求粘性路由到存入资源的进程，
+    否则上游拉取可能落到其他进程而得到 404；仅共享 ASSET_SIGNING_KEY 并不足够
+    """
+
+    def __init__(
+        self,
+        public_base_url: str,
+        signing_key: Optional[str] = None,
+        ttl: float = 120.0,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.public_base_url = public_base_url.rstrip("/")
+        # 未配置签名密钥时使用进程内随机密钥，进程重启后旧 URL 全部失效
+        self._key = (signing_key or secrets.token_hex(32)).encode("utf-8")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._items: Dict[str, Tuple[bytes, str, float]] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        logger.info(f"AssetStore 初始化完成: {self.public_base_url}, ttl={ttl}s, max_bytes={max_bytes}")
+
+    def _sign(self, asset_id: str, expires: int) -> str:
+        message = f"{asset_id}:{expires}".encode("utf-8")
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def put(self, data: bytes, content_type: str) -> Optional[Tuple[str, str]]:
+        """
+        存入资源并生成签名 URL
+
+        Args:
+            data: 资源字节数据
+            content_type: 资源 MIME 类型
+
+        Returns:
+            (资源 ID, 签名 URL)，存储已满时返回 None
+        """
+        asset_id = secrets.token_urlsafe(16)
+        expires = int(time.time() + self.ttl)
+        with self._lock:
+            if self._total_bytes + len(data) > self.max_bytes:
+                logger.warning(
+                    f"资源存储已满（{self._total_bytes}/{self.max_bytes} 字节），拒绝存入 {len(data)} 字节"
+                )
+                return None
+            self._items[asset_id] = (data, content_type, expires)
+            self._total_bytes += len(data)
+
+        signature = self._sign(asset_id, expires)
+        url = f"{self.public_base_url}/assets/{asset_id}?exp={expires}&sig={signature}"
+        logger.debug(f"存入资源 {asset_id}，大小: {len(data)} 字节")
+        return asset_id, url
+
+    def get(self, asset_id: str, expires: int, signature: str) -> Optional[Tuple[bytes, str]]:
+        """
+        校验签名并取出资源
+
+        Returns:
+            (资源字节数据, MIME 类型)，签名无效或已过期时返回 None
+        """
+        if expires < time.time():
+            return None
+        if not hmac.compare_digest(self._sign(asset_id, expires), signature):
+            return None
+
+        with self._lock:
+            item = self._items.get(asset_id)
+        if item is None:
+            return None
+
+        data, content_type, _ = item
+        return data, content_type
+
+    def discard(self, asset_id: str) -> None:
+        """上游请求结束后立即删除资源"""
+        with self._lock:
+            item = self._items.pop(asset_id, None)
+            if item is not None:
+                self._total_bytes -= len(item[0])
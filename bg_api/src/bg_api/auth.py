@@ -191,6 +191,13 @@ class AuthService:
             
             return False
     
+    def close(self) -> None:
+        """关闭 PocketBase 底层 HTTP 连接"""
+        http_client = getattr(self.pb, 'http_client', None)
+        if http_client is not None:
+            http_client.close()
+            logger.info("PocketBase 客户端连接已关闭")
+    
     async def get_record_info(self, record_id: str) -> Optional[dict]:
         """
         获取记录详细信息
@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+# 配置日志
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=getattr(logging, log_level),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class DrainingError(RuntimeError):
+    """排空开始后不再接受新任务"""
+
+
+@dataclass
+class Job:
+    """一次正在进行的图片生成任务"""
+    id: str
+    record_id: Optional[str]
+    started_at: float
+    result: Optional[bytes] = None
+    result_format: Optional[str] = None
+    delivered: bool = False
+    # 已交给响应对象，由其在发送完成后结束跟踪
+    handed_off: bool = False
+    # 被排空超时取消（区别于 uvicorn 等其他来源的取消）
+    cancelled_by_drain: bool = False
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def complete(self, data: bytes, image_format: str) -> None:
+        """记录已完成的生成结果（尚未交付给客户端）"""
+        self.result = data
+        self.result_format = image_format
+
+
+class LifecycleManager:
+    """
+    进程生命周期管理
+
+    收到 SIGTERM 后：
+    1. 就绪检查立即失败，新的生成任务返回 503
+    2. 等待进行中的任务完成（包括把结果发送给客户端），最长 drain_timeout 秒
+    3. 超时后取消剩余任务；已完成但未交付的结果写入 result_dir（如已配置）
+    4. 交还给 uvicorn 的退出流程，由 lifespan 关闭共享客户端
+    """
+
+    def __init__(self, drain_timeout: float = 60.0, result_dir: Optional[str] = None):
+        self.drain_timeout = drain_timeout
+        self.result_dir = result_dir
+        self.draining = False
+        self._jobs: Dict[str, Job] = {}
+        self._idle: Optional[asyncio.Event] = None
+        self._drain_task: Optional[asyncio.Task] = None
+        self._drain_result: Optional[asyncio.Future] = None
+        self._shutdown_hooks: List[Callable] = []
+        logger.info(f"生命周期管理器初始化完成，排空超时: {drain_timeout}s，结果目录: {result_dir}")
+
+    @property
+    def ready(self) -> bool:
+        return not self.draining
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._jobs)
+
+    def _idle_event(self) -> asyncio.Event:
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._idle.set()
+        return self._idle
+
+    def on_shutdown(self, hook: Callable) -> None:
+        """注册关闭时调用的清理函数（同步或异步），按注册的逆序执行"""
+        self._shutdown_hooks.append(hook)
+
+    def start_job(self, record_id: Optional[str] = None) -> Job:
+        """
+        开始跟踪一次生成任务，排空阶段会等待所有被跟踪的任务结束
+
+        应在请求被接纳时立即调用（早于认证与上传），否则排空可能漏掉仍在上传的请求；
+        任务绑定到当前 asyncio 任务，排空超时时会被取消；
+        调用方必须在响应发送完成（或失败）后调用 finish_job()
+
+        Returns:
+            Job 对象，生成完成后调用 job.complete()，响应体发送完成后设置 job.delivered
+
+        Raises:
+            DrainingError: 已开始排空
+        """
+        if self.draining:
+            raise DrainingError("服务正在关闭，不再接受新任务")
+        job = Job(
+            id=uuid.uuid4().hex,
+            record_id=record_id,
+            started_at=time.monotonic(),
+            task=asyncio.current_task()
+        )
+        self._jobs[job.id] = job
+        self._idle_event().clear()
+        return job
+
+    def finish_job(self, job: Job) -> None:
+        """结束跟踪任务，已完成但未交付的结果会被落盘"""
+        if job.id not in self._jobs:
+            return
+        if job.result is not None and not job.delivered:
+            self._persist(job)
+        del self._jobs[job.id]
+        if not self._jobs:
+            self._idle_event().set()
+
+    def _persist(self, job: Job) -> None:
+        """将已完成但未交付的结果写入本地结果目录"""
+        if not self.result_dir:
+            logger.warning(f"任务 {job.id} 的结果未交付，且未配置 RESULT_DIR，结果已丢弃")
+            return
+
+        try:
+            directory = os.path.join(self.result_dir, job.record_id or "anonymous")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{job.id}.{job.result_format or 'png'}")
+            with open(path, "wb") as f:
+                f.write(job.result)
+            job.delivered = True
+            logger.info(f"未交付的结果已保存: {path}")
+        except OSError as e:
+            logger.error(f"保存未交付结果失败: {e}")
+
+    def begin_shutdown(self) -> None:
+        """停止接收新任务并使就绪检查失败"""
+        if not self.draining:
+            self.draining = True
+            logger.warning(f"开始优雅关闭，停止接收新任务，进行中任务: {self.in_flight}")
+
+    async def drain(self) -> bool:
+        """
+        等待进行中的任务结束，超时后取消剩余任务
+
+        多次调用（SIGTERM 处理与 lifespan 关闭阶段）共享同一次排空
+
+        Returns:
+            是否在超时前全部完成
+        """
+        self.begin_shutdown()
+        if self._drain_result is None:
+            self._drain_result = asyncio.ensure_future(self._drain())
+        return await asyncio.shield(self._drain_result)
+
+    async def _drain(self) -> bool:
+        try:
+            await asyncio.wait_for(self._idle_event().wait(), timeout=self.drain_timeout)
+            logger.info("所有进行中的任务已完成")
+            return True
+        except asyncio.TimeoutError:
+            pass
+
+        logger.error(f"排空超时（{self.drain_timeout}s），取消剩余的 {self.in_flight} 个任务")
+        tasks = []
+        for job in list(self._jobs.values()):
+            if job.task is not None and not job.task.done():
+                job.cancelled_by_drain = True
+                job.task.cancel()
+                tasks.append(job.task)
+            else:
+                self.finish_job(job)
+        if tasks:
+            # 被取消的任务在 finish_job() 中落盘已完成的结果
+            await asyncio.wait(tasks, timeout=5.0)
+        for job in list(self._jobs.values()):
+            self.finish_job(job)
+        return False
+
+    async def close(self) -> None:
+        """执行注册的清理函数，关闭共享客户端"""
+        for hook in reversed(self._shutdown_hooks):
+            try:
+                result = hook()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"关闭清理函数执行失败: {e}")
+        self._shutdown_hooks.clear()
+        logger.info("共享客户端已关闭")
+
+    def install_signal_handler(self) -> None:
+        """
+        接管 SIGTERM：先排空任务，再调用原有处理函数（uvicorn 的退出流程）
+
+        需在事件循环中、uvicorn 安装信号处理之后调用（即 lifespan 启动阶段）；
+        不在主线程时（TestClient、线程中运行的服务器）无法安装，关闭时仍由 lifespan 排空
+        """
+        if threading.current_thread() is not threading.main_thread():
+            logger.warning("当前不在主线程，跳过安装 SIGTERM 处理函数")
+            return
+
+        loop = asyncio.get_running_loop()
+        previous = signal.getsignal(signal.SIGTERM)
+
+        async def drain_then_exit(signum: int) -> None:
+            await self.drain()
+            if callable(previous):
+                previous(signum, None)
+            else:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+
+        def handler(signum, frame) -> None:
+            if self.draining:
+                # 第二次 SIGTERM 直接交给原处理函数
+                if callable(previous):
+                    previous(signum, frame)
+                return
+            self.begin_shutdown()
+
+            def start_drain() -> None:
+                self._drain_task = loop.create_task(drain_then_exit(signum))
+
+            loop.call_soon_threadsafe(start_drain)
+
+        signal.signal(signal.SIGTERM, handler)
+        logger.info(f"已安装 SIGTERM 处理函数，排空超时: {self.drain_timeout}s")
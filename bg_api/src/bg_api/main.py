@@ -1,15 +1,25 @@
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Header, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException, Header, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from pydantic import BaseModel
 from typing import Optional, List, Annotated
 import os
+import asyncio
 import logging
-import base64
+import math
+import httpx
 from dotenv import load_dotenv
 from .openroute_client import OpenRouteClient
 from .auth import AuthService
+from .rate_limit import TokenBucketLimiter, limits_from_record
+from .assets import AssetStore
+from .presets import DEFAULT_MODEL, preset_registry
+from .lifecycle import DrainingError, Job, LifecycleManager
+from .profiling import Profiler, ProfilingMiddleware, stage
+from .offload import offload_policy
 
 # 加载环境变量
 load_dotenv()
@@ -31,10 +41,90 @@ auth_service = AuthService(
     collection_name=COLLECTION_NAME
 )
 
+# 初始化限流器（记录上未配置 rate_limit / rate_burst 时使用以下默认值）
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 10))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 5))
+
+rate_limiter = TokenBucketLimiter(
+    default_rate=RATE_LIMIT_PER_MINUTE / 60.0,
+    default_burst=RATE_LIMIT_BURST,
+    max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000)),
+    idle_ttl=float(os.getenv("RATE_LIMIT_IDLE_SECONDS", 600)),
+)
+
+# 上游传输配置
+# UPSTREAM_COMPRESS_REQUEST: 以 gzip 压缩发往上游的请求体（上游以 4xx 拒绝时用未压缩请求体重试并停止压缩）
+# UPSTREAM_IMAGE_MODE: inline（请求体内联 base64）或 url（上游通过签名 URL 拉取图片）
+# PUBLIC_BASE_URL: url 模式下上游访问本服务所用的外部地址
+UPSTREAM_COMPRESS_REQUEST = os.getenv("UPSTREAM_COMPRESS_REQUEST", "False").lower() == "true"
+UPSTREAM_IMAGE_MODE = os.getenv("UPSTREAM_IMAGE_MODE", "inline").lower()
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
+
+asset_store = None
+if UPSTREAM_IMAGE_MODE == "url":
+    if PUBLIC_BASE_URL:
+        asset_store = AssetStore(
+            public_base_url=PUBLIC_BASE_URL,
+            signing_key=os.getenv("ASSET_SIGNING_KEY"),
+            ttl=float(os.getenv("ASSET_TTL_SECONDS", 120)),
+            max_bytes=int(os.getenv("ASSET_MAX_BYTES", 64 * 1024 * 1024)),
+        )
+    else:
+        logger.warning("UPSTREAM_IMAGE_MODE=url 但未设置 PUBLIC_BASE_URL，回退为内联 base64 模式")
+
+# 生命周期管理：SIGTERM 后停止接收新任务并等待进行中的任务完成
+# SHUTDOWN_DRAIN_TIMEOUT: 最长等待秒数；RESULT_DIR: 未交付结果的保存目录（可选）
+lifecycle = LifecycleManager(
+    drain_timeout=float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 60)),
+    result_dir=os.getenv("RESULT_DIR") or None
+)
+
+# 请求性能采样（可选）
+# PROFILE_ENABLED: 是否启用；PROFILE_SAMPLE_RATE: 随机采样比例；PROFILE_SLOW_MS: 慢请求阈值
+# PROFILE_BLOCK_MS: 事件循环阻塞告警阈值；PROFILE_CAPACITY: 保留的记录条数
+# PROFILE_ADMIN_KEY: 调试请求头签名及 /admin/profiles 访问所用的管理密钥
+profiler = None
+if os.getenv("PROFILE_ENABLED", "False").lower() == "true":
+    profiler = Profiler(
+        sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0.01)),
+        slow_ms=float(os.getenv("PROFILE_SLOW_MS", 10000)),
+        block_ms=float(os.getenv("PROFILE_BLOCK_MS", 50)),
+        capacity=int(os.getenv("PROFILE_CAPACITY", 100)),
+        admin_key=os.getenv("PROFILE_ADMIN_KEY") or None
+    )
+
+# 共享的上游 HTTP 连接池，在 lifespan 中创建和关闭
+upstream_http: Optional[httpx.AsyncClient] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享客户端，关闭时排空任务并释放连接"""
+    global upstream_http
+    
+    lifecycle.install_signal_handler()
+    upstream_http = httpx.AsyncClient(timeout=60.0)
+    lifecycle.on_shutdown(offload_policy.shutdown)
+    lifecycle.on_shutdown(auth_service.close)
+    lifecycle.on_shutdown(upstream_http.aclose)
+    if profiler is not None:
+        profiler.start_monitor()
+        lifecycle.on_shutdown(profiler.stop_monitor)
+    logger.info("共享客户端创建完成")
+    
+    yield
+    
+    # 非 SIGTERM 触发的关闭（如 SIGINT）同样等待进行中的任务；SIGTERM 触发时复用已完成的排空结果
+    await lifecycle.drain()
+    await lifecycle.close()
+    upstream_http = None
+
+
 app = FastAPI(
     title="图片处理 API",
     description="使用 OpenRoute API 和 Gemini 模型处理图片",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加 CORS 中间件
@@ -46,6 +136,9 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有请求头
 )
 
+if profiler is not None:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
 logger.info("FastAPI 应用初始化完成")
 
 
@@ -62,7 +155,8 @@ async def verify_api_key(x_api_key: Annotated[str, Header(alias="X-API-Key")]) -
         )
     
     # 使用认证服务验证 API 密钥
-    result = await auth_service.verify_api_key(x_api_key)
+    with stage("auth"):
+        result = await auth_service.verify_api_key(x_api_key)
     
     if not result["valid"]:
         logger.warning(f"API 密钥验证失败: {result.get('error')}")
@@ -75,6 +169,85 @@ async def verify_api_key(x_api_key: Annotated[str, Header(alias="X-API-Key")]) -
     return result
 
 
+class JobResponse(Response):
+    """
+    生成结果响应：响应体发送完成后才标记任务已交付并结束跟踪
+
+    客户端已断开或发送失败（包括排空超时被取消）时，结果由 finish_job() 落盘；
+    发送期间才断开的连接无法检测（uvicorn 静默丢弃写入，响应完成后 receive 也只返回
+    http.disconnect），这种情况仍会被视为已交付
+    """
+
+    def __init__(self, job: Job, **kwargs):
+        super().__init__(**kwargs)
+        self.job = job
+        job.handed_off = True
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            # 断开后 uvicorn 会静默丢弃写入，需在发送前检查
+            disconnected = await Request(scope, receive).is_disconnected()
+            await super().__call__(scope, receive, send)
+            if disconnected:
+                logger.warning(f"客户端已断开，任务 {self.job.id} 的结果未交付")
+            else:
+                self.job.delivered = True
+        finally:
+            lifecycle.finish_job(self.job)
+
+
+# 请求被接纳时即开始跟踪任务，关闭阶段拒绝新任务
+async def admit_job():
+    """
+    接纳生成任务：服务正在优雅关闭时返回 503，否则在认证与上传之前开始跟踪任务
+
+    排空阶段会等待仍在认证、上传或调用上游的已接纳请求；成功时任务交给 JobResponse，
+    其余情况（认证失败、限流、异常、排空超时被取消）在此结束跟踪
+    """
+    try:
+        job = lifecycle.start_job()
+    except DrainingError:
+        logger.warning("服务正在关闭，拒绝新的生成任务")
+        raise HTTPException(
+            status_code=503,
+            detail="服务正在重启，请稍后再试",
+            headers={"Retry-After": "5"}
+        )
+    try:
+        yield job
+    except asyncio.CancelledError:
+        # 只转换排空超时发起的取消，uvicorn 等其他来源的取消照常传播
+        if not job.cancelled_by_drain:
+            raise
+        logger.error(f"排空超时，任务 {job.id} 已被取消")
+        raise HTTPException(
+            status_code=503,
+            detail="服务正在重启，任务已取消，请稍后再试",
+            headers={"Retry-After": "5"}
+        )
+    finally:
+        if not job.handed_off:
+            lifecycle.finish_job(job)
+
+
+# 限流依赖函数
+async def enforce_rate_limit(auth_result: dict = Depends(verify_api_key)) -> dict:
+    """按记录 ID 执行令牌桶限流，在解析请求体之前拒绝超限请求"""
+    record_id = auth_result.get("record_id")
+    rate, burst = limits_from_record(auth_result)
+
+    retry_after = rate_limiter.acquire(record_id, rate=rate, burst=burst)
+    if retry_after > 0:
+        logger.warning(f"请求频率超限，记录ID: {record_id}，建议 {retry_after:.1f} 秒后重试")
+        raise HTTPException(
+            status_code=429,
+            detail="请求过于频繁，请稍后再试",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+    return auth_result
+
+
 class ImageProcessResponse(BaseModel):
     """图片处理响应模型"""
     success: bool
@@ -84,23 +257,101 @@ class ImageProcessResponse(BaseModel):
     error: Optional[str] = None
 
 
-@app.post("/process-image")
+# multipart 请求体由接口手动解析，这里补充 OpenAPI 文档
+PROCESS_IMAGE_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["file"],
+                "properties": {
+                    "file": {"type": "string", "format": "binary", "description": "要处理的图片文件"},
+                    "prompt": {"type": "string", "description": "处理提示词"},
+                    "preset_id": {"type": "string", "description": "服务端预设 ID，提供时忽略 prompt"},
+                },
+            }
+        }
+    },
+}
+
+
+@app.post(
+    "/process-image",
+    openapi_extra={"requestBody": PROCESS_IMAGE_REQUEST_BODY}
+)
 async def process_image(
-    file: UploadFile = File(..., description="要处理的图片文件"),
-    prompt: str = Form(..., description="处理提示词"),
-    auth_result: dict = Depends(verify_api_key)
+    request: Request,
+    job: Job = Depends(admit_job),
+    auth_result: dict = Depends(enforce_rate_limit)
 ):
     """
     处理图片接口 - 直接返回生成的图片文件
-    
+
     需要在请求头中包含有效的 X-API-Key（PocketBase 记录 ID）
-    接受图片文件和提示词，通过 OpenRoute API 调用 Gemini 模型处理图片，直接返回生成的图片
+    同一记录的请求频率受令牌桶限制，超限返回 429 并附带 Retry-After
+    接受图片文件和提示词（或预设 ID），通过 OpenRoute API 调用 Gemini 模型处理图片，直接返回生成的图片
     """
+    # 认证、限流通过后才解析 multipart 请求体，被拒绝的请求不会读取上传的文件
+    # （声明 File / Form 参数时 FastAPI 会在执行依赖之前就读完整个请求体）
+    # 上传数据的接收与 multipart 解析都发生在这里
+    with stage("receive_upload"):
+        form = await request.form()
+    try:
+        file = form.get("file")
+        if not isinstance(file, StarletteUploadFile):
+            logger.warning("请求中缺少图片文件")
+            raise HTTPException(
+                status_code=422,
+                detail="缺少图片文件字段 file"
+            )
+        
+        prompt = form.get("prompt")
+        preset_id = form.get("preset_id")
+        return await _process_image(
+            file=file,
+            prompt=prompt if isinstance(prompt, str) else None,
+            preset_id=preset_id if isinstance(preset_id, str) else None,
+            auth_result=auth_result,
+            job=job
+        )
+    finally:
+        await form.close()
+
+
+async def _process_image(
+    file: StarletteUploadFile,
+    prompt: Optional[str],
+    preset_id: Optional[str],
+    auth_result: dict,
+    job: Job
+):
+    """处理已解析的图片上传请求"""
+    job.record_id = auth_result.get('record_id')
     logger.info(f"收到图片处理请求，记录ID: {auth_result.get('record_id')}")
     logger.info(f"当前使用次数: {auth_result.get('count', 0)}")
     logger.info(f"文件名: {file.filename}")
     logger.info(f"文件类型: {file.content_type}")
-    logger.info(f"提示词长度: {len(prompt)} 字符")
+    
+    # 解析预设或自由提示词
+    preset = None
+    if preset_id:
+        preset = preset_registry.get(preset_id)
+        if preset is None:
+            logger.warning(f"未知的预设: {preset_id}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"未知的预设: {preset_id}"
+            )
+        logger.info(f"使用预设: {preset.id} v{preset.version}")
+    elif not prompt or not prompt.strip():
+        logger.warning("请求中缺少提示词和预设 ID")
+        raise HTTPException(
+            status_code=400,
+            detail="必须提供提示词或预设 ID"
+        )
+    else:
+        logger.info(f"提示词长度: {len(prompt)} 字符")
     
     # 验证文件类型
     if not file.content_type or not file.content_type.startswith('image/'):
@@ -123,44 +374,78 @@ async def process_image(
         logger.debug(f"API 密钥前缀: {api_key[:10]}...")  # 只显示前10位用于调试
     
     try:
-        # 读取图片数据
+        # 读取图片数据（已由 request.form() 接收并暂存）
         logger.info("开始读取图片数据...")
-        image_bytes = await file.read()
+        with stage("read_upload"):
+            image_bytes = await file.read()
         logger.info(f"图片读取完成，大小: {len(image_bytes)} 字节")
         
-        # 使用固定的模型
-        model = "google/gemini-2.5-flash-image-preview:free"
+        # 预设可指定模型与生成参数，自由提示词使用固定的模型
+        if preset is not None:
+            model = preset.model
+            generation_params = {
+                "prompt": preset.prompt,
+                "text_part": preset.text_part,
+                "max_tokens": preset.max_tokens,
+                "temperature": preset.temperature,
+            }
+        else:
+            model = DEFAULT_MODEL
+            generation_params = {"prompt": prompt}
         logger.info(f"使用模型: {model}")
         
+        # URL 模式下将图片暂存为短期签名资源，由上游直接拉取
+        asset_id, image_url = None, None
+        if asset_store is not None:
+            stored = asset_store.put(image_bytes, file.content_type)
+            if stored is not None:
+                asset_id, image_url = stored
+                logger.info(f"图片已暂存为资源: {asset_id}")
+            else:
+                logger.warning("资源存储已满，本次请求回退为内联 base64")
+        
+        # 任务已在 admit_job 中开始跟踪，成功时由 JobResponse 在响应发送完成后结束跟踪
         # 使用 OpenRoute 客户端处理图片
         logger.info("创建 OpenRoute 客户端...")
-        async with OpenRouteClient(api_key=api_key) as client:
-            logger.info("开始调用 OpenRoute API...")
-            result = await client.process_image(
-                image_bytes=image_bytes,
-                prompt=prompt,
-                model=model
-            )
-            logger.info("OpenRoute API 调用完成")
-        
+        try:
+            with stage("client_init"):
+                openroute_client = OpenRouteClient(api_key=api_key, compress_request=UPSTREAM_COMPRESS_REQUEST,
+                                                   http_client=upstream_http)
+            async with openroute_client as client:
+                logger.info("开始调用 OpenRoute API...")
+                result = await client.process_image(
+                    image_bytes=image_bytes,
+                    model=model,
+                    image_url=image_url,
+                    content_type=file.content_type,
+                    **generation_params
+                )
+                logger.info("OpenRoute API 调用完成")
+        finally:
+            if asset_id:
+                asset_store.discard(asset_id)
+            
         # 检查是否有生成的图片
         if result and "generated_images" in result and result["generated_images"]:
             generated_images = result["generated_images"]
             logger.info(f"找到 {len(generated_images)} 张生成的图片")
-            
+                
             # 返回第一张生成的图片
             first_image = generated_images[0]
             image_format = first_image.get("format", "png")
             image_data = first_image.get("data", "")
-            
+                
             if image_data:
                 # 解码 base64 数据为图片字节
                 try:
-                    image_bytes = base64.b64decode(image_data)
+                    with stage("decode"):
+                        image_bytes = await offload_policy.b64decode(image_data)
                     logger.info(f"成功解码图片，大小: {len(image_bytes)} 字节")
-                    
+                    job.complete(image_bytes, image_format)
+                        
                     # 直接返回图片文件（使用次数由前端记录）
-                    return Response(
+                    response = JobResponse(
+                        job,
                         content=image_bytes,
                         media_type=f"image/{image_format}",
                         headers={
@@ -169,7 +454,8 @@ async def process_image(
                             "X-Usage-Count": str(auth_result.get('count', 0))
                         }
                     )
-                    
+                    return response
+                        
                 except Exception as decode_error:
                     logger.error(f"解码图片数据失败: {decode_error}")
                     raise HTTPException(
@@ -201,6 +487,46 @@ async def process_image(
         )
 
 
+@app.get("/assets/{asset_id}")
+async def get_asset(
+    asset_id: str,
+    exp: int = Query(..., description="过期时间戳"),
+    sig: str = Query(..., description="签名")
+):
+    """提供给上游拉取的短期签名图片资源"""
+    if asset_store is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    asset = asset_store.get(asset_id, exp, sig)
+    if asset is None:
+        logger.warning(f"资源不存在、已过期或签名无效: {asset_id}")
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    data, content_type = asset
+    return Response(
+        content=data,
+        media_type=content_type,
+        headers={"Cache-Control": "private, no-store"}
+    )
+
+
+@app.get("/presets")
+async def list_presets(
+    if_none_match: Annotated[Optional[str], Header(alias="If-None-Match")] = None
+):
+    """列出服务端预设，支持基于 ETag 的条件请求"""
+    headers = {
+        "ETag": preset_registry.etag,
+        "Cache-Control": "no-cache"
+    }
+    
+    if preset_registry.etag_matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    
+    logger.info("预设列表请求")
+    return JSONResponse(content=preset_registry.payload, headers=headers)
+
+
 @app.get("/record-info")
 async def get_record_info(auth_result: dict = Depends(verify_api_key)):
     """获取当前记录信息"""
@@ -239,6 +565,36 @@ async def health_check():
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查接口，优雅关闭期间返回 503"""
+    content = {
+        "status": "ready" if lifecycle.ready else "draining",
+        "in_flight": lifecycle.in_flight
+    }
+    if not lifecycle.ready:
+        return JSONResponse(status_code=503, content=content)
+    return content
+
+
+@app.get("/admin/profiles")
+async def list_profiles(
+    x_admin_key: Annotated[Optional[str], Header(alias="X-Admin-Key")] = None
+):
+    """查看最近采样的请求性能记录（需要管理密钥）"""
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    
+    if not profiler.verify_admin_key(x_admin_key):
+        logger.warning("性能记录访问被拒绝：管理密钥无效")
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+    
+    return {
+        "profiles": list(profiler.profiles),
+        "capacity": profiler.profiles.maxlen
+    }
+
+
 @app.get("/models")
 async def list_models():
     """列出支持的模型"""
@@ -0,0 +1,133 @@
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# 配置日志
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=getattr(logging, log_level),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# base64 的 C 实现在整个调用期间持有 GIL，大数据按块处理，
+# 让事件循环线程在块之间有机会拿回 GIL（原始数据 768KB / base64 文本 1MB 一块）
+_ENCODE_CHUNK = 3 * 256 * 1024
+_DECODE_CHUNK = 4 * 256 * 1024
+
+
+class OffloadPolicy:
+    """
+    CPU 密集操作的卸载策略
+
+    小于 threshold 字节的数据直接在事件循环中处理（线程切换的开销更大），
+    超过阈值的数据交给有界线程池，避免大图片的编解码长时间占用事件循环
+
+    这些操作都持有 GIL，线程数越多事件循环抢回 GIL 越难，且吞吐不会提高，
+    默认只用 1 个工作线程（可用 bench_offload.py 对比不同配置）
+    """
+
+    def __init__(self, threshold: int = 256 * 1024, max_workers: int = 1):
+        self.threshold = threshold
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        logger.info(
+            f"卸载策略初始化完成: threshold={threshold} 字节, max_workers={max_workers}, "
+            f"JSON 解析器: {'orjson' if orjson is not None else 'json'}"
+        )
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="bg_api_offload"
+            )
+        return self._executor
+
+    async def run(self, func: Callable, *args, size: int) -> Any:
+        """
+        按数据大小决定在事件循环内执行还是卸载到线程池
+
+        Args:
+            func: 同步函数
+            args: 函数参数
+            size: 待处理数据的字节数
+        """
+        if size < self.threshold:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def b64encode(self, data: bytes) -> str:
+        return await self.run(_b64encode, data, size=len(data))
+
+    async def b64decode(self, data: str) -> bytes:
+        return await self.run(_b64decode, data, size=len(data))
+
+    async def json_loads(self, data: bytes) -> Any:
+        return await self.run(loads, data, size=len(data))
+
+    def shutdown(self) -> None:
+        """关闭线程池，等待已提交的任务完成"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            logger.info("卸载线程池已关闭")
+
+
+def _b64encode(data: bytes) -> str:
+    if len(data) <= _ENCODE_CHUNK:
+        return base64.b64encode(data).decode('utf-8')
+    view = memoryview(data)
+    return "".join(
+        base64.b64encode(view[i:i + _ENCODE_CHUNK]).decode('utf-8')
+        for i in range(0, len(data), _ENCODE_CHUNK)
+    )
+
+
+def _b64decode(data: str) -> bytes:
+    if len(data) <= _DECODE_CHUNK:
+        return base64.b64decode(data)
+    try:
+        # 分块要求输入不含换行等非 base64 字符，否则块边界会错位
+        return b"".join(
+            base64.b64decode(data[i:i + _DECODE_CHUNK], validate=True)
+            for i in range(0, len(data), _DECODE_CHUNK)
+        )
+    except binascii.Error:
+        return base64.b64decode(data)
+
+
+def loads(data) -> Any:
+    """解析 JSON，安装了 orjson 时优先使用"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def split_data_url(url: str) -> tuple:
+    """
+    拆分 data URL
+
+    Returns:
+        (图片格式, base64 数据)
+    """
+    format_part, data_part = url.split(",", 1)
+    img_format = format_part.split(";")[0].split("/")[1]
+    return img_format, data_part
+
+
+offload_policy = OffloadPolicy(
+    threshold=int(os.getenv("OFFLOAD_THRESHOLD_BYTES", 256 * 1024)),
+    max_workers=int(os.getenv("OFFLOAD_MAX_WORKERS", 1))
+)
@@ -1,8 +1,13 @@
-import base64
+import contextlib
+import gzip
+import json
 import logging
 import os
 from typing import Optional
 from openai import AsyncOpenAI
+from .presets import build_text_part
+from .profiling import stage
+from .offload import offload_policy, split_data_url
 
 # 配置日志
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -15,9 +20,19 @@ logger = logging.getLogger(__name__)
 
 class OpenRouteClient:
     """OpenRoute API 客户端，使用 OpenAI SDK 调用图片处理服务"""
+
+    # 上游拒绝过 gzip 请求体后，在进程生命周期内不再尝试压缩
+    _request_compression_rejected = False
+    
+    # 这些状态码与请求体编码无关，不值得用未压缩请求体重试
+    _NON_ENCODING_ERRORS = (401, 402, 403, 404, 429)
     
-    def __init__(self, api_key: Optional[str] = None, base_url: str = "https://openrouter.ai/api/v1"):
+    def __init__(self, api_key: Optional[str] = None, base_url: str = "https://openrouter.ai/api/v1",
+                 compress_request: bool = False, http_client=None):
         self.api_key = api_key
+        self.compress_request = compress_request
+        # 外部传入的共享 httpx.AsyncClient，由调用方负责关闭
+        self.http_client = http_client
         self.client = AsyncOpenAI(
             base_url=base_url,
             api_key=api_key
@@ -32,14 +47,34 @@ class OpenRouteClient:
         logger.debug("OpenRouteClient 退出异步上下文")
         await self.client.close()
     
-    def _encode_image_to_base64(self, image_bytes: bytes) -> str:
-        """将图片字节转换为 base64 编码"""
+    async def _encode_image_to_base64(self, image_bytes: bytes) -> str:
+        """将图片字节转换为 base64 编码（大图片在线程池中编码）"""
         logger.debug(f"开始编码图片，大小: {len(image_bytes)} 字节")
-        encoded = base64.b64encode(image_bytes).decode('utf-8')
+        encoded = await offload_policy.b64encode(image_bytes)
         logger.debug(f"图片编码完成，base64 长度: {len(encoded)}")
         return encoded
     
-    async def process_image(self, image_bytes: bytes, prompt: str, model: str = "google/gemini-2.5-flash-image-preview:free") -> dict:
+    def _build_body(self, request_data: dict, compress: bool) -> tuple:
+        """
+        序列化请求体，compress 为 True 时进行 gzip 压缩
+
+        Returns:
+            (请求体字节, 附加请求头, 压缩前字节数)
+        """
+        body = json.dumps(request_data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        raw_size = len(body)
+
+        if compress:
+            compressed = gzip.compress(body, compresslevel=5)
+            logger.debug(f"请求体 gzip 压缩: {raw_size} -> {len(compressed)} 字节")
+            return compressed, {"Content-Encoding": "gzip"}, raw_size
+
+        return body, {}, raw_size
+    
+    async def process_image(self, image_bytes: bytes, prompt: str, model: str = "google/gemini-2.5-flash-image-preview:free",
+                            image_url: Optional[str] = None, content_type: str = "image/png",
+                            max_tokens: int = 4096, temperature: float = 0.7,
+                            text_part: Optional[dict] = None) -> dict:
         """
         调用 OpenRoute API 处理图片
         
@@ -47,6 +82,11 @@ class OpenRouteClient:
             image_bytes: 图片字节数据
             prompt: 处理提示词
             model: 使用的模型，默认为 google/gemini-2.5-flash-image-preview:free
+            image_url: 上游可访问的图片 URL，提供时不再内联 base64
+            content_type: 图片 MIME 类型，用于构造 data URL
+            max_tokens: 最大生成 token 数
+            temperature: 采样温度
+            text_part: 预先构造好的消息文本部分（预设使用），为 None 时由 prompt 构造
             
         Returns:
             API 响应结果
@@ -57,8 +97,16 @@ class OpenRouteClient:
         logger.info(f"图片大小: {len(image_bytes)} 字节")
         
         try:
-            # 将图片编码为 base64
-            image_base64 = self._encode_image_to_base64(image_bytes)
+            if text_part is None:
+                text_part = build_text_part(prompt)
+            
+            if image_url:
+                logger.info("使用资源 URL 模式发送图片")
+            else:
+                # 将图片编码为 base64
+                with stage("encode"):
+                    image_base64 = await self._encode_image_to_base64(image_bytes)
+                image_url = f"data:{content_type};base64,{image_base64}"
             
             # 构建请求参数 - 尝试不同的图片生成参数
             request_params = {
@@ -77,22 +125,19 @@ class OpenRouteClient:
                     {
                         "role": "user",
                         "content": [
-                            {
-                                "type": "text",
-                                "text": f"GENERATE IMAGE: {prompt}. Please create and return the actual image data/file, not just a description."
-                            },
+                            text_part,
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}"
+                                    "url": image_url
                                 }
                             }
                         ]
                     }
                 ],
                 # 尝试不同的参数
-                "max_tokens": 4096,
-                "temperature": 0.7,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
                 "top_p": 1.0,
             }
             
@@ -104,13 +149,17 @@ class OpenRouteClient:
             
             import httpx
             
-            # 直接用 httpx 获取完整响应
-            async with httpx.AsyncClient(timeout=60.0) as client:
+            # 直接用 httpx 获取完整响应，优先复用共享连接池
+            async with contextlib.AsyncExitStack() as stack:
+                client = self.http_client
+                if client is None:
+                    client = await stack.enter_async_context(httpx.AsyncClient(timeout=60.0))
+                
                 request_data = {
                     "model": model,
                     "messages": request_params["messages"],
-                    "max_tokens": 4096,
-                    "temperature": 0.7,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
                 }
                 
                 headers = {
@@ -120,16 +169,61 @@ class OpenRouteClient:
                     "X-Title": "Image Processing API",
                 }
                 
-                response = await client.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    json=request_data,
-                    headers=headers
+                # 响应的 Accept-Encoding 由 httpx 按已安装的解码器（gzip/deflate/br/zstd）自动协商
+                compress = self.compress_request and not OpenRouteClient._request_compression_rejected
+                with stage("serialize"):
+                    body, body_headers, raw_size = await offload_policy.run(
+                        self._build_body, request_data, compress, size=len(image_url)
+                    )
+                
+                # 被拒绝的压缩请求同样占用了上行带宽，计入请求字节数
+                rejected_bytes = 0
+                with stage("upstream"):
+                    response = await client.post(
+                        "https://openrouter.ai/api/v1/chat/completions",
+                        content=body,
+                        headers={**headers, **body_headers}
+                    )
+                    
+                    if (body_headers and 400 <= response.status_code < 500
+                            and response.status_code not in self._NON_ENCODING_ERRORS):
+                        # 上游可能不接受压缩请求体（415/400/413/422 等），用未压缩请求体重试
+                        logger.warning(f"压缩请求体被拒绝（HTTP {response.status_code}），改用未压缩请求体重试")
+                        compressed_status = response.status_code
+                        rejected_bytes = len(body)
+                        body, body_headers, raw_size = await offload_policy.run(
+                            self._build_body, request_data, False, size=len(image_url)
+                        )
+                        response = await client.post(
+                            "https://openrouter.ai/api/v1/chat/completions",
+                            content=body,
+                            headers=headers
+                        )
+                        if response.status_code < 400:
+                            # 只有未压缩请求成功时才确认是压缩导致的失败，之后不再压缩
+                            logger.warning(f"上游不支持 gzip 请求体（HTTP {compressed_status}），后续请求不再压缩")
+                            OpenRouteClient._request_compression_rejected = True
+                
+                # 统计实际传输字节数
+                transfer_stats = {
+                    "request_bytes": rejected_bytes + len(body),
+                    "request_attempts": 2 if rejected_bytes else 1,
+                    "request_raw_bytes": raw_size,
+                    "request_encoding": body_headers.get("Content-Encoding", "identity"),
+                    "response_bytes": response.num_bytes_downloaded,
+                    "response_raw_bytes": len(response.content),
+                    "response_encoding": response.headers.get("Content-Encoding", "identity"),
+                }
+                logger.info(
+                    f"传输字节 - 请求: {transfer_stats['request_bytes']}/{raw_size} ({transfer_stats['request_encoding']}), "
+                    f"响应: {transfer_stats['response_bytes']}/{transfer_stats['response_raw_bytes']} ({transfer_stats['response_encoding']})"
                 )
                 
                 if response.status_code != 200:
                     raise Exception(f"HTTP {response.status_code}: {response.text}")
                 
-                data = response.json()
+                with stage("parse_json"):
+                    data = await offload_policy.json_loads(response.content)
                 logger.info("收到 OpenRouter API 响应")
             
             # 记录响应基本信息
@@ -169,8 +263,9 @@ class OpenRouteClient:
                                     
                                     try:
                                         # 解析图片数据
-                                        format_part, data_part = img_url.split(",", 1)
-                                        img_format = format_part.split(";")[0].split("/")[1]
+                                        img_format, data_part = await offload_policy.run(
+                                            split_data_url, img_url, size=len(img_url)
+                                        )
                                         
                                         generated_images.append({
                                             "format": img_format,
@@ -202,6 +297,7 @@ class OpenRouteClient:
             
             # 构建返回结果
             result = data.copy()  # 使用原始数据
+            result["transfer_stats"] = transfer_stats
             
             # 如果找到图片，添加到结果中
             if generated_images:
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict
+from functools import cached_property
+from typing import Dict, List, Optional
+
+# 配置日志
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=getattr(logging, log_level),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "google/gemini-2.5-flash-image-preview:free"
+
+# 发送给模型的提示词外层模板
+PROMPT_TEMPLATE = "GENERATE IMAGE: {prompt}. Please create and return the actual image data/file, not just a description."
+
+
+def render_prompt(prompt: str) -> str:
+    """用外层模板包装用户提示词"""
+    return PROMPT_TEMPLATE.format(prompt=prompt)
+
+
+def build_text_part(prompt: str) -> dict:
+    """构造消息 content 中的文本部分"""
+    return {"type": "text", "text": render_prompt(prompt)}
+
+
+@dataclass(frozen=True)
+class PromptPreset:
+    """服务端预设提示词"""
+    id: str
+    name: str
+    version: int
+    prompt: str
+    model: str = DEFAULT_MODEL
+    max_tokens: int = 4096
+    temperature: float = 0.7
+
+    @cached_property
+    def text_part(self) -> dict:
+        """
+        预先构造好的消息文本部分，所有使用该预设的请求共享同一对象
+
+        只会被序列化，不应被修改；图片部分因请求而异，仍需每次构造
+        """
+        return build_text_part(self.prompt)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class PresetRegistry:
+    """预设注册表，负责按 ID 查找预设并生成带 ETag 的列表数据"""
+
+    def __init__(self, presets: List[PromptPreset]):
+        self._presets: Dict[str, PromptPreset] = {}
+        for preset in presets:
+            if preset.id in self._presets:
+                raise ValueError(f"重复的预设 ID: {preset.id}")
+            self._presets[preset.id] = preset
+            # 注册时预热消息文本部分
+            preset.text_part
+
+        self.payload = {"presets": [preset.to_dict() for preset in self._presets.values()]}
+        digest = hashlib.sha256(
+            json.dumps(self.payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        self.etag = f'"{digest[:32]}"'
+        logger.info(f"预设注册表初始化完成，共 {len(self._presets)} 个预设，ETag: {self.etag}")
+
+    def __len__(self) -> int:
+        return len(self._presets)
+
+    def get(self, preset_id: str) -> Optional[PromptPreset]:
+        return self._presets.get(preset_id)
+
+    def etag_matches(self, if_none_match: Optional[str]) -> bool:
+        """
+        判断 If-None-Match 是否命中当前 ETag
+
+        按 RFC 9110 使用弱比较：支持 "*"、逗号分隔的多个值以及 W/ 前缀
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == self.etag:
+                return True
+        return False
+
+
+# 内置预设 - 在这里添加新的预设即可在前端自动生成按钮
+# 修改提示词或参数时请递增 version
+DEFAULT_PRESETS = [
+    PromptPreset(
+        id="figure",
+        name="默认手办",
+        version=1,
+        prompt="turn this photo into a character figure. Behind it, place a box with the character's image printed on it, and a computer showing the Blender modeling process on its screen. In front of the box, add a round plastic base with the character figure standing on it. Make the PVC material look clear, and set the scene indoors if possible",
+    ),
+    PromptPreset(
+        id="photo-restore",
+        name="老照片修复",
+        version=1,
+        prompt="1.只截取照片内容部分，移除桌面的背景、边框 2.修复照片里面的污损 3.把照片做成彩色的 4.高清放大照片",
+    ),
+]
+
+preset_registry = PresetRegistry(DEFAULT_PRESETS)
@@ -0,0 +1,252 @@
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional, Set
+
+# 配置日志
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=getattr(logging, log_level),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 当前请求的性能记录，未启用采样时为 None
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("bg_api_profile", default=None)
+
+
+class RequestProfile:
+    """单个请求的分阶段耗时记录"""
+
+    def __init__(self, method: str, path: str, forced: bool = False):
+        self.method = method
+        self.path = path
+        self.forced = forced
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages: List[dict] = []
+        self.loop_blocks: List[dict] = []
+        self.duration_ms: Optional[float] = None
+        self.status_code: Optional[int] = None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def _blocking_stage(self, block: dict) -> Optional[str]:
+        """
+        找出与阻塞时间窗口重叠最多的阶段
+
+        检测器只能在阻塞结束后醒来，此时所处的阶段往往已经不是阻塞的来源
+        """
+        block_start = block["start_ms"]
+        block_end = block_start + block["blocked_ms"]
+        best_stage, best_overlap = None, 0.0
+        for s in self.stages:
+            overlap = min(block_end, s["start_ms"] + s["duration_ms"]) - max(block_start, s["start_ms"])
+            if overlap > best_overlap:
+                best_stage, best_overlap = s["name"], overlap
+        return best_stage
+
+    def to_dict(self) -> dict:
+        loop_blocks = [
+            {**block, "stage": self._blocking_stage(block)} for block in self.loop_blocks
+        ]
+        return {
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms or 0, 2),
+            "status_code": self.status_code,
+            "forced": self.forced,
+            "stages": self.stages,
+            "loop_blocks": loop_blocks,
+        }
+
+
+@contextmanager
+def stage(name: str):
+    """
+    记录一个处理阶段的耗时，当前请求未被跟踪时不做任何事
+
+    用法:
+        with stage("upstream"):
+            response = await client.post(...)
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = profile.elapsed_ms()
+    try:
+        yield
+    finally:
+        end = profile.elapsed_ms()
+        profile.stages.append({
+            "name": name,
+            "start_ms": round(start, 2),
+            "duration_ms": round(end - start, 2),
+        })
+
+
+class Profiler:
+    """
+    请求级性能采样器
+
+    满足以下任一条件的请求会被保留到环形缓冲区：
+    - 按 sample_rate 随机采样
+    - 总耗时超过 slow_ms
+    - 携带用管理密钥签名的调试请求头
+    同时运行事件循环阻塞检测，记录同步调用占用事件循环超过 block_ms 的情况
+    """
+
+    HEADER = "x-profile"
+    SIGNATURE_MAX_AGE = 300
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        slow_ms: float = 10000.0,
+        block_ms: float = 50.0,
+        capacity: int = 100,
+        admin_key: Optional[str] = None,
+        paths: tuple = ("/process-image",),
+    ):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.block_ms = block_ms
+        self.admin_key = admin_key
+        self.paths = paths
+        self.profiles: deque = deque(maxlen=capacity)
+        self._active: Set[RequestProfile] = set()
+        self._monitor_task: Optional[asyncio.Task] = None
+        logger.info(
+            f"性能采样初始化完成: sample_rate={sample_rate}, slow_ms={slow_ms}, "
+            f"block_ms={block_ms}, capacity={capacity}"
+        )
+
+    def sign(self, timestamp: int) -> str:
+        """生成调试请求头的值: <时间戳>:<HMAC 签名>"""
+        signature = hmac.new(
+            self.admin_key.encode("utf-8"), str(timestamp).encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+        return f"{timestamp}:{signature}"
+
+    def verify_header(self, value: Optional[str]) -> bool:
+        """校验调试请求头的签名和时效"""
+        if not value or not self.admin_key:
+            return False
+        try:
+            timestamp_str, _ = value.split(":", 1)
+            timestamp = int(timestamp_str)
+        except ValueError:
+            return False
+        if abs(time.time() - timestamp) > self.SIGNATURE_MAX_AGE:
+            return False
+        return hmac.compare_digest(self.sign(timestamp), value)
+
+    def verify_admin_key(self, value: Optional[str]) -> bool:
+        if not value or not self.admin_key:
+            return False
+        return hmac.compare_digest(value, self.admin_key)
+
+    def should_track(self, path: str) -> bool:
+        return any(path.startswith(prefix) for prefix in self.paths)
+
+    def start(self, method: str, path: str, forced: bool) -> contextvars.Token:
+        profile = RequestProfile(method, path, forced)
+        self._active.add(profile)
+        return _current_profile.set(profile)
+
+    def finish(self, token: contextvars.Token, status_code: Optional[int]) -> None:
+        profile = _current_profile.get()
+        _current_profile.reset(token)
+        if profile is None:
+            return
+        self._active.discard(profile)
+
+        profile.duration_ms = profile.elapsed_ms()
+        profile.status_code = status_code
+
+        keep = (
+            profile.forced
+            or profile.duration_ms >= self.slow_ms
+            or random.random() < self.sample_rate
+        )
+        if keep:
+            self.profiles.append(profile.to_dict())
+            logger.info(
+                f"记录请求性能: {profile.method} {profile.path} {profile.duration_ms:.1f}ms, "
+                f"阶段: {[(s['name'], s['duration_ms']) for s in profile.stages]}"
+            )
+
+    async def _monitor_loop(self, interval: float = 0.01) -> None:
+        """按固定间隔休眠，实际唤醒延迟超过阈值即说明事件循环被阻塞"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag_ms = (loop.time() - expected) * 1000
+            if lag_ms < self.block_ms:
+                continue
+
+            logger.warning(f"事件循环被阻塞 {lag_ms:.1f}ms")
+            for profile in list(self._active):
+                profile.loop_blocks.append({
+                    "start_ms": round(profile.elapsed_ms() - lag_ms, 2),
+                    "blocked_ms": round(lag_ms, 2),
+                })
+
+    def start_monitor(self) -> None:
+        if self._monitor_task is None:
+            self._monitor_task = asyncio.get_running_loop().create_task(self._monitor_loop())
+
+    async def stop_monitor(self) -> None:
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            self._monitor_task = None
+
+
+class ProfilingMiddleware:
+    """ASGI 中间件：为匹配路径的请求建立性能记录上下文"""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_track(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        header_value = None
+        for key, value in scope.get("headers", []):
+            if key.decode("latin-1").lower() == Profiler.HEADER:
+                header_value = value.decode("latin-1")
+                break
+        forced = self.profiler.verify_header(header_value)
+
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = self.profiler.start(scope["method"], scope["path"], forced)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.profiler.finish(token, status_code)
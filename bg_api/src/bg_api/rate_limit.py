@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+# 配置日志
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=getattr(logging, log_level),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Bucket:
+    """单个 key 的令牌桶状态"""
+    tokens: float
+    rate: float
+    burst: float
+    updated_at: float
+
+    def refill_time(self) -> float:
+        """从空桶回满所需的秒数"""
+        return self.burst / self.rate
+
+
+class TokenBucketLimiter:
+    """
+    按 key 划分的内存令牌桶限流器
+
+    桶存放在按最近访问排序的 OrderedDict 中：
+    - 空闲超过 max(idle_ttl, burst / rate) 秒的桶会被淘汰（此时桶已回满，淘汰不改变限流语义）
+    - 桶数量超过 max_keys 时淘汰最久未访问的桶，保证内存有上界
+    """
+
+    def __init__(
+        self,
+        default_rate: float = 1.0,
+        default_burst: float = 5.0,
+        max_keys: int = 100_000,
+        idle_ttl: float = 600.0,
+    ):
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        logger.info(
+            f"令牌桶限流器初始化完成: rate={default_rate}/s, burst={default_burst}, "
+            f"max_keys={max_keys}, idle_ttl={idle_ttl}s"
+        )
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _evict(self, now: float) -> None:
+        """淘汰空闲桶以及超出容量上限的桶（调用方需持有锁）"""
+        # OrderedDict 头部是最久未访问的桶，遇到未过期的即可停止
+        # （回满较慢的桶会推迟其后桶的淘汰，内存仍由 max_keys 限制）
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated_at < max(self.idle_ttl, bucket.refill_time()):
+                break
+            del self._buckets[key]
+
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def acquire(
+        self,
+        key: str,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        cost: float = 1.0,
+    ) -> float:
+        """
+        尝试从 key 对应的桶中取出令牌
+
+        Args:
+            key: 限流维度（API 密钥 / 记录 ID）
+            rate: 每秒补充的令牌数，None 或非正数时使用默认值
+            burst: 桶容量，None 或非正数时使用默认值，且不小于 cost
+            cost: 本次请求消耗的令牌数
+
+        Returns:
+            0 表示放行；否则为建议的重试等待秒数
+        """
+        rate = rate if rate is not None and rate > 0 else self.default_rate
+        burst = burst if burst is not None and burst > 0 else self.default_burst
+        if rate <= 0:
+            # 仅当部署配置的默认速率为 0 时整体关闭限流（RATE_LIMIT_PER_MINUTE=0）
+            return 0.0
+        # 桶容量小于单次消耗时永远攒不够令牌，请求会被无限期拒绝
+        burst = max(burst, cost)
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = _Bucket(tokens=burst, rate=rate, burst=burst, updated_at=now)
+                self._buckets[key] = bucket
+            else:
+                self._buckets.move_to_end(key)
+                # 记录上的配置可能被修改，按最新配置补充令牌
+                bucket.rate = rate
+                bucket.burst = burst
+                elapsed = now - bucket.updated_at
+                bucket.tokens = min(burst, bucket.tokens + elapsed * rate)
+                bucket.updated_at = now
+
+            self._evict(now)
+
+            if bucket.tokens >= cost:
+                bucket.tokens -= cost
+                return 0.0
+
+            return (cost - bucket.tokens) / rate
+
+
+def _parse_limit(value, default: Optional[float]) -> Optional[float]:
+    """
+    解析记录字段中的限流配置，空值、非法值或非正数回退到默认值
+
+    PocketBase 数字字段未填写时返回 0，因此 0 只能视为"未设置"
+    """
+    if value in (None, ""):
+        return default
+    try:
+        parsed = float(value)
+    except (TypeError, ValueError):
+        logger.warning(f"无效的限流配置值: {value!r}，使用默认值 {default}")
+        return default
+    if parsed <= 0:
+        return default
+    return parsed
+
+
+def limits_from_record(record: dict) -> tuple:
+    """
+    从 PocketBase 记录中读取限流配置
+
+    记录字段（与 count / exp_time 同级），未填写（0）或负数时使用默认值：
+    - rate_limit: 每分钟允许的请求数
+    - rate_burst: 突发容量
+
+    Returns:
+        (每秒速率或 None, 突发容量或 None)，None 表示使用限流器默认值
+    """
+    per_minute = _parse_limit(record.get("rate_limit"), None)
+    burst = _parse_limit(record.get("rate_burst"), None)
+    rate = per_minute / 60.0 if per_minute is not None else None
+    return rate, burst
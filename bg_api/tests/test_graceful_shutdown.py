@@ -0,0 +1,177 @@
+"""
+优雅关闭测试：在并发生成任务进行中发送 SIGTERM，验证已开始的任务全部交付
+
+服务在子进程中通过 uvicorn 启动，上游 OpenRoute 与 PocketBase 认证均被替换为本地模拟
+"""
+import asyncio
+import base64
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+CONCURRENT_REQUESTS = 10
+UPSTREAM_DELAY = 3.0
+GENERATED_IMAGE = b"\x89PNG\r\n\x1a\n generated"
+
+# 子进程启动脚本：替换上游客户端与认证后在主线程运行 uvicorn（以便接管 SIGTERM）
+# uvicorn 自身的关闭等待设得很短，未被排空跟踪的请求会在排空结束后被它取消
+SERVER_SCRIPT = textwrap.dedent(f"""
+    import asyncio
+    import base64
+    import sys
+
+    import httpx
+    import uvicorn
+
+    from bg_api import main
+
+    IMAGE = {base64.b64encode(GENERATED_IMAGE).decode()!r}
+
+    async def slow_upstream(request):
+        await asyncio.sleep({UPSTREAM_DELAY})
+        return httpx.Response(200, json={{
+            "choices": [{{"message": {{"images": [
+                {{"image_url": {{"url": "data:image/png;base64," + IMAGE}}}}
+            ]}}}}]
+        }})
+
+    real_client = httpx.AsyncClient
+
+    def mock_client(*args, **kwargs):
+        kwargs["transport"] = httpx.MockTransport(slow_upstream)
+        return real_client(*args, **kwargs)
+
+    async def verify_api_key(api_key):
+        return {{"valid": True, "record_id": "test-record", "user_id": "test-user", "count": 1}}
+
+    main.httpx.AsyncClient = mock_client
+    main.auth_service.verify_api_key = verify_api_key
+
+    uvicorn.run(main.app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning",
+                timeout_graceful_shutdown=1)
+""")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server(tmp_path):
+    port = _free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(SRC_DIR),
+        OPENROUTE_API_KEY="test-key",
+        RATE_LIMIT_PER_MINUTE="0",
+        SHUTDOWN_DRAIN_TIMEOUT="30",
+        RESULT_DIR=str(tmp_path / "results"),
+        PROFILE_ENABLED="False",
+    )
+    proc = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT, str(port)], env=env, cwd=tmp_path)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                break
+        except httpx.TransportError:
+            pass
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            pytest.fail("服务启动失败")
+        time.sleep(0.1)
+
+    yield proc, base_url, tmp_path / "results"
+
+    if proc.poll() is None:
+        proc.kill()
+        proc.wait()
+
+
+def _post_image(client: httpx.AsyncClient):
+    return client.post(
+        "/process-image",
+        headers={"X-API-Key": "test-api-key"},
+        files={"file": ("input.png", b"input image", "image/png")},
+        data={"preset_id": "figure"},
+    )
+
+
+async def _slow_upload(chunks, delay: float):
+    for chunk in chunks:
+        yield chunk
+        await asyncio.sleep(delay)
+
+
+def test_sigterm_under_load_delivers_all_started_generations(server):
+    proc, base_url, result_dir = server
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+            in_flight = [asyncio.create_task(_post_image(client)) for _ in range(CONCURRENT_REQUESTS)]
+            # 等待所有请求进入上游调用阶段
+            await asyncio.sleep(UPSTREAM_DELAY / 3)
+
+            proc.send_signal(signal.SIGTERM)
+            await asyncio.sleep(0.2)
+
+            ready = await client.get("/ready")
+            rejected = await _post_image(client)
+            responses = await asyncio.gather(*in_flight)
+            return ready, rejected, responses
+
+    ready, rejected, responses = asyncio.run(scenario())
+
+    assert ready.status_code == 503
+    assert ready.json()["status"] == "draining"
+    assert rejected.status_code == 503
+    assert [r.status_code for r in responses] == [200] * CONCURRENT_REQUESTS
+    assert all(r.content == GENERATED_IMAGE for r in responses)
+
+    # 较新的 uvicorn 在完成关闭后会重新触发捕获到的信号
+    assert proc.wait(timeout=30) in (0, -signal.SIGTERM)
+    # 全部交付，不应有落盘的结果
+    assert not result_dir.exists() or not any(result_dir.rglob("*.*"))
+
+
+def test_sigterm_during_upload_waits_for_admitted_request(server):
+    proc, base_url, result_dir = server
+    # 预先编码 multipart 请求体，再分块缓慢发送
+    encoded = httpx.Request(
+        "POST", f"{base_url}/process-image",
+        files={"file": ("input.png", b"input image" * 1000, "image/png")},
+        data={"preset_id": "figure"},
+    )
+    body = encoded.read()
+    chunks = [body[i:i + 1024] for i in range(0, len(body), 1024)]
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+            upload = asyncio.create_task(client.post(
+                "/process-image",
+                headers={"X-API-Key": "test-api-key", "Content-Type": encoded.headers["Content-Type"]},
+                content=_slow_upload(chunks, 1.5 / len(chunks)),
+            ))
+            # 请求已被接纳但仍在上传时关闭
+            await asyncio.sleep(0.3)
+            proc.send_signal(signal.SIGTERM)
+            return await upload
+
+    response = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert response.content == GENERATED_IMAGE
+    assert proc.wait(timeout=30) in (0, -signal.SIGTERM)
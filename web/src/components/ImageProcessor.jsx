@@ -2,6 +2,20 @@ import { useState, useRef, useEffect, useCallback } from 'react'
 import ImageViewer from './ImageViewer'
 import wechatQR from '../assets/wechat-qr.jpg'
 
+// 本地备用预设，仅在无法从服务端 /presets 获取时使用
+const defaultPresets = [
+  {
+    id: 'figure',
+    name: '默认手办',
+    prompt: "turn this photo into a character figure. Behind it, place a box with the character's image printed on it, and a computer showing the Blender modeling process on its screen. In front of the box, add a round plastic base with the character figure standing on it. Make the PVC material look clear, and set the scene indoors if possible"
+  },
+  {
+    id: 'photo-restore',
+    name: '老照片修复',
+    prompt: '1.只截取照片内容部分，移除桌面的背景、边框 2.修复照片里面的污损 3.把照片做成彩色的 4.高清放大照片'
+  }
+]
+
 // Toast 通知组件
 const Toast = ({ message, type = 'error', onClose }) => {
   useEffect(() => {
@@ -171,7 +185,10 @@ const ApiSettingsModal = ({ onSave, onClose, currentKey }) => {
 const ImageProcessor = () => {
   const [selectedImage, setSelectedImage] = useState(null)
   const [imagePreview, setImagePreview] = useState(null)
-  const [prompt, setPrompt] = useState("turn this photo into a character figure. Behind it, place a box with the character's image printed on it, and a computer showing the Blender modeling process on its screen. In front of the box, add a round plastic base with the character figure standing on it. Make the PVC material look clear, and set the scene indoors if possible");
+  const [prompt, setPrompt] = useState(defaultPresets[0].prompt);
+  const [presets, setPresets] = useState(defaultPresets) // 预设列表，加载成功后替换为服务端预设
+  const [presetsFromServer, setPresetsFromServer] = useState(false)
+  const [selectedPresetId, setSelectedPresetId] = useState(defaultPresets[0].id) // 提示词被手动修改后清空
   const [isProcessing, setIsProcessing] = useState(false)
   const [result, setResult] = useState(null)
   const [error, setError] = useState('')
@@ -186,6 +203,7 @@ const ImageProcessor = () => {
   const [userDailyLimit, setUserDailyLimit] = useState(0) // 用户每日限额，从API获取
   
   const fileInputRef = useRef(null)
+  const promptEditedRef = useRef(false) // 用户是否手动修改过提示词
 
   // 从API获取用户每日使用限额
   const fetchUserDailyLimit = useCallback(async (username) => {
@@ -316,12 +334,35 @@ const ImageProcessor = () => {
     setToast(null)
   }
 
-  // 预设提示词配置 - 在这里添加新的预设即可自动生成按钮
-  const presetPrompts = {
-    "默认手办": "turn this photo into a character figure. Behind it, place a box with the character's image printed on it, and a computer showing the Blender modeling process on its screen. In front of the box, add a round plastic base with the character figure standing on it. Make the PVC material look clear, and set the scene indoors if possible",
-    "老照片修复": "1.只截取照片内容部分，移除桌面的背景、边框 2.修复照片里面的污损 3.把照片做成彩色的 4.高清放大照片"
-    // 在此添加更多预设，格式：
-    // "名称": "提示词内容",
+  // 从服务端加载预设列表（预设配置见 bg_api/src/bg_api/presets.py）
+  useEffect(() => {
+    const apiUrl = import.meta.env.VITE_API_URL || 'http://127.0.0.1:8097'
+    fetch(`${apiUrl}/presets`)
+      .then(response => response.ok ? response.json() : Promise.reject(new Error(`HTTP ${response.status}`)))
+      .then(data => {
+        if (Array.isArray(data.presets) && data.presets.length > 0) {
+          setPresets(data.presets)
+          setPresetsFromServer(true)
+          if (!promptEditedRef.current) {
+            // 提示词未被修改时改用服务端的默认预设，避免显示与实际生成不一致的本地提示词
+            setPrompt(data.presets[0].prompt)
+            setSelectedPresetId(data.presets[0].id)
+          } else {
+            // 服务端不存在的预设 ID 提交时会返回 400
+            setSelectedPresetId(id => data.presets.some(preset => preset.id === id) ? id : null)
+          }
+        }
+      })
+      .catch(error => {
+        console.warn('获取服务端预设失败，使用本地预设:', error)
+      })
+  }, [])
+
+  // 选择预设：填充提示词并记录预设 ID，提交时只发送 ID
+  const selectPreset = (preset) => {
+    promptEditedRef.current = false
+    setPrompt(preset.prompt)
+    setSelectedPresetId(preset.id)
   }
 
   // 初始化用户名：从URL参数或localStorage获取
@@ -458,7 +499,11 @@ const ImageProcessor = () => {
     try {
       const formData = new FormData()
       formData.append('file', selectedImage)
-      formData.append('prompt', prompt)
+      if (presetsFromServer && selectedPresetId) {
+        formData.append('preset_id', selectedPresetId)
+      } else {
+        formData.append('prompt', prompt)
+      }
 
       const apiUrl = import.meta.env.VITE_API_URL || 'http://127.0.0.1:8097'
       const response = await fetch(`${apiUrl}/process-image`, {
@@ -717,7 +762,7 @@ const ImageProcessor = () => {
                 </label>
                 <button 
                   className="text-sm text-base-content/60 hover:text-primary transition-colors cursor-pointer" 
-                  onClick={() => setPrompt(presetPrompts["默认手办"])}
+                  onClick={() => selectPreset(presets[0])}
                 >
                   恢复默认
                 </button>
@@ -726,24 +771,28 @@ const ImageProcessor = () => {
                 className="w-full h-32 p-4 border border-base-300 rounded-xl bg-base-50 focus:bg-base-100 focus:border-primary focus:outline-none resize-none transition-all duration-200"
                 placeholder="描述你想要的手办效果..."
                 value={prompt}
-                onChange={(e) => setPrompt(e.target.value)}
+                onChange={(e) => {
+                  promptEditedRef.current = true
+                  setPrompt(e.target.value)
+                  setSelectedPresetId(null)
+                }}
               />
             </div>
 
             {/* 预设选项 */}
-            {Object.keys(presetPrompts).length > 0 && (
+            {presets.length > 0 && (
               <div>
                 <label className="block text-base font-medium text-base-content mb-3">
                   快速选择预设
                 </label>
                 <div className="flex flex-wrap gap-2">
-                  {Object.entries(presetPrompts).map(([name, promptText]) => (
+                  {presets.map((preset) => (
                     <button 
-                      key={name}
+                      key={preset.id}
                       className="px-4 py-2 bg-base-200 hover:bg-primary hover:text-primary-content rounded-lg transition-all duration-200 text-sm font-medium"
-                      onClick={() => setPrompt(promptText)}
+                      onClick={() => selectPreset(preset)}
                     >
-                      {name}
+                      {preset.name}
                     </button>
                   ))}
                 </div>